@@ -2,11 +2,10 @@
 
 import argparse
 import logging
-import os
-import shutil
+import re
 import sys
-import tempfile
-import time
+
+from proxychains_conf import PROXY_RE, atomic_rewrite
 
 # --- 1. 設定日誌 ---
 logging.basicConfig(
@@ -15,6 +14,10 @@ logging.basicConfig(
     handlers=[logging.StreamHandler(sys.stdout)]
 )
 
+# 鏈策略行 (可能被註解) 的比對規則，於模組載入時編譯一次；
+# 整行只能是策略名稱，避免把以策略名稱開頭的說明註解 (例如 "# random_chain is good to ...") 當成指令
+_STRAT_RE = re.compile(r'^\s*(#?)\s*(random_chain|round_robin_chain|strict_chain|dynamic_chain)\s*$')
+
 # --- 2. 更新 Proxychains 設定檔函數 ---
 def update_proxychains_with_pool(
     validated_proxies_list,
@@ -34,134 +37,102 @@ def update_proxychains_with_pool(
     Returns:
         bool: 更新成功返回 True，否則 False。
     """
-    if os.geteuid() != 0:
-        logging.error(f"更新 {conf_path} 需要 root 權限。請使用 sudo 執行。")
-        return False
-
-    if not os.path.exists(conf_path):
-        logging.error(f"設定檔 {conf_path} 不存在。")
-        return False
-
-    backup_path = f"{conf_path}.bak.pool.{int(time.time())}"
-    logging.info(f"正在備份 {conf_path} 到 {backup_path}...")
-    try:
-        shutil.copy2(conf_path, backup_path)
-    except Exception as e:
-        logging.error(f"備份失敗: {e}")
-        return False
-
-    new_config_lines = []
-    original_lines = []
-    try:
-        with open(conf_path, 'r', encoding='utf-8') as f_read:
-            original_lines = f_read.readlines()
-    except Exception as e:
-        logging.error(f"讀取設定檔 {conf_path} 失敗: {e}")
-        return False
+    # 代理行只解析與格式化一次，兩個寫入位置共用
+    proxy_prefix = f"{default_proxy_type} "
+    proxy_lines = []
+    for proxy_ip_port in validated_proxies_list:
+        ip, sep, port = proxy_ip_port.partition(':')
+        if not sep or ':' in port:
+            logging.warning(f"代理格式錯誤，已跳過: {proxy_ip_port}")
+            continue
+        proxy_lines.append(proxy_prefix + ip + ' ' + port + '\n')
 
     # 已知鏈策略指令
     known_strategies = ["random_chain", "round_robin_chain", "strict_chain", "dynamic_chain"]
+
+    # 每個策略行的輸出在迴圈前針對此次的 chain_strategy 決定一次
+    enabled_line = f"{chain_strategy}\n"
+    strategy_lines = {}
+    for known_strat in known_strategies:
+        if known_strat == chain_strategy or (known_strat == "dynamic_chain" and chain_strategy == "strict_chain"): # dynamic_chain is alias for strict_chain
+            strategy_lines[known_strat] = enabled_line # 取消註解並設定為選擇的策略
+        else:
+            strategy_lines[known_strat] = f"#{known_strat}\n" # 註解掉其他策略 (已註解的行保留原樣)
+
     strategy_set = False
-    in_proxy_list_section = False
-    proxy_list_header_written = False
-
-    for line in original_lines:
-        stripped_line = line.strip()
-
-        # 處理鏈策略行
-        is_strategy_line = False
-        for known_strat in known_strategies:
-            if stripped_line.startswith(known_strat) or stripped_line.startswith(f"#{known_strat}"):
-                is_strategy_line = True
-                if known_strat == chain_strategy or (known_strat == "dynamic_chain" and chain_strategy == "strict_chain"): # dynamic_chain is alias for strict_chain
-                    new_config_lines.append(f"{chain_strategy}\n") # 取消註解並設定為選擇的策略
-                    strategy_set = True
-                    logging.debug(f"設定鏈策略為: {chain_strategy}")
-                elif known_strat == "dynamic_chain" and chain_strategy != "strict_chain" and chain_strategy != "dynamic_chain":
-                     new_config_lines.append(f"#{known_strat}\n") # 註解掉 dynamic_chain 如果不是選它
-                elif chain_strategy != known_strat : # 註解掉其他策略
-                    new_config_lines.append(f"#{known_strat}\n" if not stripped_line.startswith("#") else line)
-                else: # 其他情況，例如 dynamic_chain 和 strict_chain 互相對應
-                    new_config_lines.append(line) # 保留原樣，可能已正確
-                break
-        
-        if is_strategy_line:
-            continue
 
-        # 處理 [ProxyList] 區段
-        if stripped_line == "[ProxyList]":
-            new_config_lines.append("[ProxyList]\n")
-            logging.debug("找到 [ProxyList] 區段。正在寫入提供的代理...")
-            for proxy_ip_port in validated_proxies_list:
-                try:
-                    ip, port = proxy_ip_port.split(':')
-                    new_config_lines.append(f"{default_proxy_type} {ip} {port}\n")
-                except ValueError:
-                    logging.warning(f"代理格式錯誤，已跳過: {proxy_ip_port}")
-            in_proxy_list_section = True
-            proxy_list_header_written = True
-            continue
-        
-        if in_proxy_list_section:
-            # 在 [ProxyList] 區段之後，我們只保留註解、空行或新的區段標頭
-            if stripped_line.startswith("#") or not stripped_line or stripped_line.startswith("["):
-                new_config_lines.append(line)
-                if stripped_line.startswith("[") and stripped_line != "[ProxyList]":
-                    in_proxy_list_section = False # 離開 ProxyList 區段
-            # 其他 (看起來像舊代理的行) 會被忽略
-            continue
-            
-        new_config_lines.append(line)
-
-    # 如果遍歷完畢，策略行仍未被顯式設定（例如原設定檔中沒有對應行）
-    if not strategy_set and chain_strategy in known_strategies:
-        # 嘗試在檔案開頭附近插入策略（這是一個簡化處理，理想位置可能更複雜）
-        # 或者，更好的做法是要求 `proxychains4.conf` 至少包含被註解的策略行
-        logging.warning(f"選擇的策略 '{chain_strategy}' 在原設定檔中沒有對應的行可以取消註解。將嘗試添加。")
-        # 簡單地加到設定檔頂部，通常策略設定在頂部
-        new_config_lines.insert(0, f"{chain_strategy}\n")
-
-
-    # 如果原檔案沒有 [ProxyList] 標頭，則在末尾添加
-    if not proxy_list_header_written:
-        logging.warning(f"設定檔 {conf_path} 中未找到 [ProxyList] 標頭。將在檔案末尾添加代理。")
-        new_config_lines.append("\n[ProxyList]\n")
-        for proxy_ip_port in validated_proxies_list:
-            try:
-                ip, port = proxy_ip_port.split(':')
-                new_config_lines.append(f"{default_proxy_type} {ip} {port}\n")
-            except ValueError:
-                logging.warning(f"代理格式錯誤，已跳過: {proxy_ip_port}")
-
-
-    # 使用臨時檔案進行寫入
-    try:
-        with tempfile.NamedTemporaryFile(mode='w', delete=False, encoding='utf-8', dir=os.path.dirname(conf_path)) as temp_f:
-            temp_path = temp_f.name
-            for line_to_write in new_config_lines:
-                temp_f.write(line_to_write)
-        
-        shutil.move(temp_path, conf_path)
-        try:
-            shutil.copymode(backup_path, conf_path)
-            original_stat = os.stat(backup_path)
-            shutil.chown(conf_path, user=original_stat.st_uid, group=original_stat.st_gid)
-        except Exception as e:
-            logging.warning(f"設定檔案權限或擁有者時出錯: {e}")
-
-        logging.info(f"已成功更新 {conf_path}。啟用策略: {chain_strategy}。共加入 {len(validated_proxies_list)} 個代理。")
-        return True
-    except Exception as e:
-        logging.error(f"寫入更新後的設定檔 {conf_path} 失敗: {e}")
-        logging.info(f"正在從備份 {backup_path} 還原...")
-        try:
-            shutil.move(backup_path, conf_path)
-        except Exception as restore_e:
-            logging.error(f"還原設定檔失敗: {restore_e}.")
+    def rewrite(lines):
+        nonlocal strategy_set
+        in_proxy_list_section = False
+        proxy_list_header_written = False
+        for line in lines:
+            stripped_line = line.strip()
+
+            # 處理鏈策略行
+            m = _STRAT_RE.match(line)
+            if m:
+                new_line = strategy_lines[m.group(2)]
+                if new_line is enabled_line:
+                    if not strategy_set:
+                        logging.debug(f"設定鏈策略為: {chain_strategy}")
+                        strategy_set = True
+                    yield new_line
+                else:
+                    yield line if m.group(1) else new_line
+                continue
+
+            # 處理 [ProxyList] 區段
+            if stripped_line == "[ProxyList]":
+                logging.debug("找到 [ProxyList] 區段。正在寫入提供的代理...")
+                yield "[ProxyList]\n"
+                yield from proxy_lines
+                in_proxy_list_section = True
+                proxy_list_header_written = True
+                continue
+
+            if in_proxy_list_section:
+                # 在 [ProxyList] 區段之後，我們只保留註解、空行或新的區段標頭
+                if stripped_line.startswith("#") or not stripped_line or stripped_line.startswith("["):
+                    yield line
+                    if stripped_line.startswith("[") and stripped_line != "[ProxyList]":
+                        in_proxy_list_section = False # 離開 ProxyList 區段
+                # 其他 (看起來像舊代理的行) 會被忽略
+                continue
+
+            yield line
+
+        # 如果原檔案沒有 [ProxyList] 標頭，則在末尾添加
+        if not proxy_list_header_written:
+            logging.warning(f"設定檔 {conf_path} 中未找到 [ProxyList] 標頭。將在檔案末尾添加代理。")
+            yield "\n[ProxyList]\n"
+            yield from proxy_lines
+
+    def transform(lines):
+        # 在遇到要啟用的策略行之前先暫存輸出 (通常只有檔案開頭幾行)，
+        # 若整份設定檔都沒有對應的策略行，才能把策略補在最前面
+        pending = []
+        for out_line in rewrite(lines):
+            if pending is None:
+                yield out_line
+            elif strategy_set:
+                yield from pending
+                yield out_line
+                pending = None
+            else:
+                pending.append(out_line)
+        if pending is not None:
+            # 策略行仍未被顯式設定（例如原設定檔中沒有對應行）
+            if chain_strategy in known_strategies:
+                # 或者，更好的做法是要求 `proxychains4.conf` 至少包含被註解的策略行
+                logging.warning(f"選擇的策略 '{chain_strategy}' 在原設定檔中沒有對應的行可以取消註解。將嘗試添加。")
+                # 簡單地加到設定檔頂部，通常策略設定在頂部
+                yield f"{chain_strategy}\n"
+            yield from pending
+
+    if not atomic_rewrite(conf_path, transform, backup_suffix="bak.pool"):
         return False
-    finally:
-        if 'temp_path' in locals() and os.path.exists(temp_path):
-            os.remove(temp_path)
+    logging.info(f"已成功設定 {conf_path}。啟用策略: {chain_strategy}。共加入 {len(validated_proxies_list)} 個代理。")
+    return True
 
 # --- 3. 主程式 ---
 def main():
@@ -191,10 +162,8 @@ def main():
     validated_proxies = []
     try:
         with open(args.input_file, 'r', encoding='utf-8') as f:
-            validated_proxies = [
-                line.strip() for line in f
-                if line.strip() and not line.strip().startswith('#') and ':' in line.strip()
-            ]
+            # 去除重複代理 (保留檔案中的原始順序)
+            validated_proxies = list(dict.fromkeys(m.group(0).strip() for m in (PROXY_RE.match(line) for line in f) if m))
         if not validated_proxies:
             logging.error(f"提供的代理清單檔案 {args.input_file} 為空或格式不符。程式終止。")
             sys.exit(1)
@@ -1,15 +1,23 @@
 #!/usr/bin/env python3
 
-import requests
+import aiohttp
+import asyncio
 import sys
 import time
 import logging
 import argparse
-import tempfile
-import shutil
+import ipaddress
+import signal
 import os
+import threading
 from random import choice
-from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from proxychains_conf import PROXY_RE, atomic_rewrite
+
+try:
+    import uvloop # 可選：以 libuv 為基礎的較快事件迴圈
+except ImportError:
+    uvloop = None
 
 # --- 1. 設定日誌 ---
 logging.basicConfig(
@@ -19,125 +27,178 @@ logging.basicConfig(
         logging.StreamHandler(sys.stdout)
     ]
 )
+# 日誌格式未使用執行緒/行程資訊，略過每筆紀錄填入這些欄位
+logging.logThreads = False
+logging.logProcesses = False
+logging.logMultiprocessing = False
 
 # --- 2. 代理驗證函數 ---
-def check_proxy(proxy, timeout, test_url):
+async def _tcp_ping(proxy, short_timeout):
     """
-    檢查單個代理是否可用。
+    以短逾時嘗試與代理建立 TCP 連線，快速排除在 TCP 層就無法連線的代理。
     """
-    proxies_dict = {'http': f'http://{proxy}', 'https': f'http://{proxy}'}
+    host, _, port = proxy.rpartition(':')
     try:
-        r = requests.get(test_url, proxies=proxies_dict, timeout=timeout)
-        if r.status_code == 200:
-            logging.debug(f"代理 {proxy} 驗證成功。")
-            return proxy, True
-        else:
-            logging.warning(f"代理 {proxy} 驗證失敗 (狀態碼: {r.status_code})。")
-            return proxy, False
-    except requests.exceptions.Timeout:
+        _, writer = await asyncio.wait_for(asyncio.open_connection(host, int(port)), short_timeout)
+    except asyncio.TimeoutError:
+        logging.warning(f"代理 {proxy} TCP 連線超時 ({short_timeout} 秒)。")
+        return False
+    except (OSError, ValueError) as e:
+        logging.warning(f"代理 {proxy} TCP 連線失敗: {e}")
+        return False
+    writer.close()
+    return True
+
+async def _probe_proxy(session, proxy, timeout, test_url):
+    try:
+        async with session.get(test_url, proxy=f'http://{proxy}') as r:
+            if r.status == 200:
+                if logging.root.isEnabledFor(logging.DEBUG): # 未啟用 DEBUG 時不建構訊息字串
+                    logging.debug(f"代理 {proxy} 驗證成功。")
+                return True
+            else:
+                logging.warning(f"代理 {proxy} 驗證失敗 (狀態碼: {r.status})。")
+                return False
+    except asyncio.TimeoutError:
         logging.warning(f"代理 {proxy} 驗證超時 ({timeout} 秒)。")
-        return proxy, False
-    except requests.exceptions.RequestException as e:
+        return False
+    except (aiohttp.ClientError, ValueError) as e:
         logging.warning(f"代理 {proxy} 驗證失敗: {e}")
-        return proxy, False
+        return False
 
-def check_proxies_concurrently(proxies_list, timeout, test_url, max_workers):
+async def check_proxy_async(session, sem, proxy, timeout, test_url, tcp_timeout=1.0):
     """
-    使用線程池並行檢查代理清單。
+    非同步檢查單個代理是否可用。
+    tcp_timeout > 0 時先做 TCP 連線預檢，連不上就不再發出 HTTP 請求。
     """
-    valid_proxies = []
-    if not proxies_list:
-        return valid_proxies
+    async with sem:
+        if tcp_timeout > 0 and not await _tcp_ping(proxy, min(tcp_timeout, timeout)):
+            is_valid = False
+        else:
+            is_valid = await _probe_proxy(session, proxy, timeout, test_url)
+    return proxy, is_valid
 
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        future_to_proxy = {executor.submit(check_proxy, proxy, timeout, test_url): proxy for proxy in proxies_list}
+async def _check_proxies_async(proxies_list, timeout, test_url, max_workers, chunk_factor=4, tcp_timeout=1.0):
+    """
+    在單一事件迴圈上並行檢查代理清單，並以 Semaphore 限制同時連線數。
+    代理以每批 max_workers * chunk_factor 個分批建立檢查任務，記憶體用量不隨清單大小成長。
+    """
+    valid_proxies = set()
+    sem = asyncio.Semaphore(max_workers)
+    connector = aiohttp.TCPConnector(limit=max_workers, ssl=False)
+    # 所有檢查共用同一個 session/連線池與逾時設定；不讀取環境變數中的代理設定
+    async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=timeout),
+                                     trust_env=False) as session:
         total_proxies = len(proxies_list)
+        chunk_size = max(1, max_workers * chunk_factor)
+        # 進度日誌固定每完成約 5% (最多每 1000 個) 輸出一次，而非隨 max_workers 頻繁輸出
+        progress_step = min(1000, max(1, total_proxies // 20))
         logging.info(f"開始並行檢查 {total_proxies} 個代理...")
-        for i, future in enumerate(as_completed(future_to_proxy)):
-            proxy, is_valid = future.result()
-            if is_valid:
-                valid_proxies.append(proxy)
-            if (i + 1) % (max_workers // 2 if max_workers > 1 else 1) == 0 or (i + 1) == total_proxies: # 適時更新進度
-                 logging.info(f"已檢查 {i+1}/{total_proxies} 個代理... 目前找到 {len(valid_proxies)} 個可用代理。")
-    return valid_proxies
+        checked = 0
+        for start in range(0, total_proxies, chunk_size):
+            tasks = [check_proxy_async(session, sem, proxy, timeout, test_url, tcp_timeout)
+                     for proxy in proxies_list[start:start + chunk_size]]
+            for coro in asyncio.as_completed(tasks):
+                proxy, is_valid = await coro
+                checked += 1
+                if is_valid:
+                    valid_proxies.add(proxy)
+                if checked % progress_step == 0 or checked == total_proxies: # 適時更新進度
+                     logging.info(f"已檢查 {checked}/{total_proxies} 個代理... 目前找到 {len(valid_proxies)} 個可用代理。")
+    return sorted(valid_proxies)
 
-# --- 3. Proxychains 設定檔更新函數 ---
-def update_proxychains_conf(proxy_address, conf_path, proxy_type="http"):
+def _is_usable_proxy(proxy, allow_private=False):
     """
-    更新 proxychains 設定檔。
+    不發出任何連線，先排除明顯無法使用的代理：連接埠超出範圍，或 (除非 allow_private) 私有/迴路/多播位址。
+    主機名稱無法在此判斷，一律保留。
     """
-    if os.geteuid() != 0:
-        logging.error(f"更新 {conf_path} 需要 root 權限。請使用 sudo 執行。")
-        return False
-
-    if not os.path.exists(conf_path):
-        logging.error(f"設定檔 {conf_path} 不存在。")
+    host, _, port = proxy.rpartition(':')
+    if not port.isdigit() or not 0 < int(port) < 65536:
         return False
-
-    backup_path = f"{conf_path}.bak.{int(time.time())}"
-    logging.info(f"正在備份 {conf_path} 到 {backup_path}...")
-    try:
-        shutil.copy2(conf_path, backup_path)
-    except Exception as e:
-        logging.error(f"備份失敗: {e}")
-        return False
-
-    new_lines = []
     try:
-        with open(conf_path, 'r', encoding='utf-8') as f_read:
-            for line in f_read:
-                stripped_line = line.strip()
-                if not (stripped_line.startswith('http ') or \
-                        stripped_line.startswith('socks4 ') or \
-                        stripped_line.startswith('socks5 ') or \
-                        stripped_line.startswith('https ')):
-                    new_lines.append(line)
-                else:
-                    logging.debug(f"移除舊代理行: {stripped_line}")
+        addr = ipaddress.ip_address(host)
+    except ValueError:
+        return bool(host)
+    if allow_private:
+        return True
+    return not (addr.is_private or addr.is_loopback or addr.is_multicast or addr.is_unspecified)
 
-        ip, port = proxy_address.split(':')
-        new_proxy_line = f"{proxy_type} {ip} {port}\n"
+def check_proxies_concurrently(proxies_list, timeout, test_url, max_workers, chunk_factor=4, allow_private=False,
+                               tcp_timeout=1.0):
+    """
+    並行檢查代理清單 (同步包裝，內部使用 asyncio + aiohttp；若已安裝 uvloop 則使用 uvloop 事件迴圈)。
+    """
+    usable_proxies = [proxy for proxy in proxies_list if _is_usable_proxy(proxy, allow_private)]
+    if len(usable_proxies) != len(proxies_list):
+        logging.info(f"已略過 {len(proxies_list) - len(usable_proxies)} 個位址無效或不可路由的代理 (私有/迴路/多播位址或連接埠錯誤)。")
+    proxies_list = usable_proxies
+    if not proxies_list:
+        return []
+    coro = _check_proxies_async(proxies_list, timeout, test_url, max_workers, chunk_factor, tcp_timeout)
+    if uvloop is not None:
+        if hasattr(uvloop, 'run'):
+            return uvloop.run(coro)
+        # uvloop < 0.18 (例如部分發行版套件) 沒有 uvloop.run，改以事件迴圈 policy 套用
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    return asyncio.run(coro)
 
-        proxy_list_tag_index = -1
-        for i, line_content in enumerate(new_lines):
-            if line_content.strip() == "[ProxyList]":
-                proxy_list_tag_index = i
-                break
-        
-        if proxy_list_tag_index != -1:
-            new_lines.insert(proxy_list_tag_index + 1, f"# Added by script at {time.ctime()}\n")
-            new_lines.insert(proxy_list_tag_index + 2, new_proxy_line)
-        else:
-            new_lines.append(f"\n# Added by script at {time.ctime()} (no [ProxyList] tag found)\n")
-            new_lines.append(new_proxy_line)
+# --- 3. Proxychains 設定檔更新函數 ---
+# 本程式加入的時間戳註解行前綴；比較設定內容是否變更時會略過這些行
+_ADDED_MARKER = "# Added by script at"
 
-        with tempfile.NamedTemporaryFile(mode='w', delete=False, encoding='utf-8', dir=os.path.dirname(conf_path)) as temp_f:
-            temp_path = temp_f.name
-            for line_to_write in new_lines:
-                temp_f.write(line_to_write)
+# 每個設定檔最後一次由本程式寫入 (或確認無需變更) 時的狀態: conf_path -> (代理行, st_mtime_ns, st_size)
+_last_written = {}
 
-        shutil.move(temp_path, conf_path)
-        try:
-            shutil.copymode(backup_path, conf_path)
-            original_stat = os.stat(backup_path)
-            shutil.chown(conf_path, user=original_stat.st_uid, group=original_stat.st_gid)
-        except Exception as e:
-            logging.warning(f"設定檔案權限或擁有者時出錯: {e}")
+def update_proxychains_conf(proxy_address, conf_path, proxy_type="http", original_stat=None):
+    """
+    更新 proxychains 設定檔。若更新後的內容 (不含時間戳註解) 與目前檔案相同，則不備份也不重寫。
+    original_stat 為要維持的權限與擁有者 (os.stat 結果)，未提供時使用改寫前設定檔的。
+    """
+    try:
+        ip, port = proxy_address.split(':')
+    except ValueError:
+        logging.error(f"代理格式錯誤: {proxy_address}")
+        return False
+    new_proxy_line = f"{proxy_type} {ip} {port}\n"
 
-        logging.info(f"已更新 {conf_path} 使用代理: {proxy_type} {proxy_address}")
+    # 上次由本程式寫入的就是同一個代理，且檔案之後未被修改，連讀取都可以省略
+    try:
+        conf_stat = os.stat(conf_path)
+    except OSError:
+        conf_stat = None # 交由 atomic_rewrite 回報錯誤
+    if conf_stat and _last_written.get(conf_path) == (new_proxy_line, conf_stat.st_mtime_ns, conf_stat.st_size):
+        logging.info(f"{conf_path} 已使用代理 {proxy_type} {proxy_address}，略過更新。")
         return True
 
-    except Exception as e:
-        logging.error(f"更新設定檔 {conf_path} 失敗: {e}")
-        logging.info(f"正在從備份 {backup_path} 還原...")
-        try:
-            shutil.move(backup_path, conf_path)
-        except Exception as restore_e:
-            logging.error(f"還原設定檔失敗: {restore_e}.")
+    def transform(lines):
+        proxy_list_tag_found = False
+        last_line = "\n"
+        for line in lines:
+            stripped_line = line.strip()
+            if stripped_line.startswith(_ADDED_MARKER):
+                continue # 移除先前由本程式加入的時間戳註解，避免每次輪換都累積一行
+            if stripped_line.startswith(('http ', 'socks4 ', 'socks5 ', 'https ')):
+                if logging.root.isEnabledFor(logging.DEBUG):
+                    logging.debug(f"移除舊代理行: {stripped_line}")
+                continue
+            yield line
+            last_line = line
+            if not proxy_list_tag_found and stripped_line == "[ProxyList]":
+                proxy_list_tag_found = True
+                yield f"{_ADDED_MARKER} {time.ctime()}\n"
+                yield new_proxy_line
+        if not proxy_list_tag_found:
+            if last_line.strip():
+                yield "\n" # 與前一行隔開；前一行已是空行時不再重複加入
+            yield f"{_ADDED_MARKER} {time.ctime()} (no [ProxyList] tag found)\n"
+            yield new_proxy_line
+
+    written_stat = atomic_rewrite(conf_path, transform, "bak", original_stat, ignore_prefix=_ADDED_MARKER, conf_stat=conf_stat)
+    if not written_stat:
         return False
-    finally:
-        if 'temp_path' in locals() and os.path.exists(temp_path):
-            os.remove(temp_path)
+    _last_written[conf_path] = (new_proxy_line, written_stat.st_mtime_ns, written_stat.st_size)
+    logging.info(f"{conf_path} 已設定為使用代理: {proxy_type} {proxy_address}")
+    return True
 
 # --- 4. 匯出可用代理到檔案 ---
 def export_valid_proxies(valid_proxies, output_file_path):
@@ -149,9 +210,10 @@ def export_valid_proxies(valid_proxies, output_file_path):
         return
 
     try:
-        with open(output_file_path, 'w', encoding='utf-8') as f:
-            for proxy in valid_proxies:
-                f.write(f"{proxy}\n")
+        # 一次編碼並寫入整份內容，而非逐行寫入文字模式的檔案
+        data = ('\n'.join(valid_proxies) + '\n').encode('utf-8')
+        with open(output_file_path, 'wb') as f:
+            f.write(data)
         logging.info(f"已成功將 {len(valid_proxies)} 個可用代理匯出到: {output_file_path}")
     except IOError as e:
         logging.error(f"匯出可用代理到檔案 {output_file_path} 失敗: {e}")
@@ -169,23 +231,40 @@ def main():
                         help="指定一個 TXT 檔案路徑，用於儲存測試後可用的代理清單。\n若未指定，則不匯出到檔案。")
     parser.add_argument('-t', '--timeout', type=int, default=5,
                         help="代理驗證的超時時間 (秒)。\n預設: 5")
+    parser.add_argument('--tcp-timeout', type=float, default=1.0,
+                        help="發出 HTTP 驗證前 TCP 連線預檢的超時時間 (秒)，設為 0 則停用預檢。\n預設: 1.0")
     parser.add_argument('-u', '--url', default='http://icanhazip.com',
                         help="用於驗證代理的 URL。\n預設: http://icanhazip.com")
     parser.add_argument('-w', '--workers', type=int, default=20,
-                        help="並行驗證代理的執行緒數量。\n預設: 20")
+                        help="並行驗證代理的最大同時連線數量。\n預設: 20")
+    parser.add_argument('--chunk-factor', type=int, default=4,
+                        help="每批建立的檢查任務數為 workers 的幾倍，用於限制大量代理時的記憶體用量。\n預設: 4")
     parser.add_argument('-c', '--conf', default='/etc/proxychains4.conf',
                         help="proxychains 設定檔路徑。\n預設: /etc/proxychains4.conf")
     parser.add_argument('-s', '--sleep', type=int, default=60,
                         help="代理切換間隔時間 (秒)。\n預設: 60")
     parser.add_argument('--proxy-type', default='http', choices=['http', 'socks4', 'socks5', 'https'],
                         help="要設定到 proxychains 的代理類型。\n預設: http")
+    parser.add_argument('--allow-private', action='store_true',
+                        help="不略過私有、迴路 (127.0.0.1) 或多播位址的代理 (例如使用區域網路內的代理時)。")
     parser.add_argument('--no-update', action='store_true',
                         help="僅驗證代理並匯出 (如果指定了 -o)，不更新 proxychains4.conf。")
     parser.add_argument('--verbose', '-v', action='store_true',
                         help="啟用 DEBUG 等級日誌輸出。")
+    parser.add_argument('--fast-log', action='store_true',
+                        help="使用不含時間戳的精簡日誌格式，減少大量驗證失敗訊息時的格式化開銷。")
 
     args = parser.parse_args()
 
+    if args.fast_log:
+        # 不含 %(asctime)s，每筆紀錄不必再呼叫 time.localtime() + strftime
+        logging.basicConfig(
+            level=logging.INFO,
+            format='%(levelname).1s %(message)s',
+            handlers=[logging.StreamHandler(sys.stdout)],
+            force=True
+        )
+
     if args.verbose:
         logging.getLogger().setLevel(logging.DEBUG)
 
@@ -193,10 +272,8 @@ def main():
     logging.info(f"準備從檔案 '{args.file}' 讀取代理清單...")
     try:
         with open(args.file, 'r', encoding='utf-8') as f:
-            proxies = [
-                line.strip() for line in f
-                if line.strip() and not line.strip().startswith('#') and ':' in line.strip()
-            ]
+            # 以 dict.fromkeys 去除重複代理 (保留檔案中的原始順序)，避免重複驗證
+            proxies = list(dict.fromkeys(m.group(0).strip() for m in (PROXY_RE.match(line) for line in f) if m))
         logging.info(f"從 {args.file} 成功讀取了 {len(proxies)} 個代理。")
         if not proxies:
             logging.warning(f"代理清單 {args.file} 為空或格式不符。請確保每行格式為 'ip:port'。")
@@ -213,7 +290,8 @@ def main():
         logging.warning("沒有從檔案中讀取到任何代理，無法進行驗證。")
         valid_proxies = []
     else:
-        valid_proxies = check_proxies_concurrently(proxies, args.timeout, args.url, args.workers)
+        valid_proxies = check_proxies_concurrently(proxies, args.timeout, args.url, args.workers, args.chunk_factor,
+                                                   args.allow_private, args.tcp_timeout)
     
     logging.info(f"代理驗證完成，共找到 {len(valid_proxies)} 個可用代理。")
 
@@ -242,23 +320,36 @@ def main():
 
     # 進入代理輪換模式
     logging.info(f"進入代理輪換模式 (每 {args.sleep} 秒切換一次，按 Ctrl+C 結束)...")
+    # 收到 SIGINT/SIGTERM 時設定事件，讓等待中的迴圈立即醒來並結束
+    stop_event = threading.Event()
+    signal.signal(signal.SIGINT, lambda *_: stop_event.set())
+    signal.signal(signal.SIGTERM, lambda *_: stop_event.set())
+    current_proxy = None # 目前已寫入設定檔的代理
     try:
-        while True:
+        initial_stat = os.stat(args.conf) # 輪換期間權限與擁有者不變，只在開始時讀取一次
+    except OSError:
+        initial_stat = None # 交由 update_proxychains_conf 回報錯誤
+    try:
+        while not stop_event.is_set():
             if not valid_proxies: # 理論上前面已經處理，但作為防禦性程式碼
                 logging.error("輪換模式中止：沒有可用的代理。")
                 break
             selected_proxy = choice(valid_proxies)
             logging.info(f">> 嘗試使用代理：{selected_proxy} (類型: {args.proxy_type}) 到 {args.conf}")
             
-            if update_proxychains_conf(selected_proxy, args.conf, args.proxy_type):
+            if selected_proxy == current_proxy:
+                logging.info(f"代理 {selected_proxy} 已是目前設定，略過更新 {args.conf}。")
+            elif update_proxychains_conf(selected_proxy, args.conf, args.proxy_type, initial_stat):
+                current_proxy = selected_proxy
                 logging.info(f"成功將代理 {selected_proxy} 設定到 {args.conf}")
             else:
                  logging.warning(f"更新 {args.conf} 失敗。將在下個週期重試。")
             
             logging.info(f"等待 {args.sleep} 秒進行下一次切換...")
-            time.sleep(args.sleep)
-    except KeyboardInterrupt:
-        logging.info("收到使用者中斷訊號 (Ctrl+C)，程式結束。")
+            if stop_event.wait(args.sleep):
+                break
+        if stop_event.is_set():
+            logging.info("收到中斷或終止訊號 (Ctrl+C / SIGTERM)，程式結束。")
     except Exception as e:
         logging.error(f"主迴圈發生未知錯誤: {e}", exc_info=True)
     finally:
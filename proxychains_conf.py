@@ -0,0 +1,128 @@
+"""
+proxy_pool_check.py 與 config_proxy_pool.py 共用的代理清單解析與 proxychains 設定檔安全改寫工具。
+需與兩個腳本放在同一個目錄。
+"""
+
+import hashlib
+import logging
+import os
+import re
+import shutil
+import stat
+import tempfile
+import time
+
+# 代理清單行 ('ip:port'，略過註解與空行) 的比對規則，於模組載入時編譯一次
+PROXY_RE = re.compile(r'^\s*([^#\s][^:\s]*):(\d{1,5})\s*$')
+
+
+def fast_backup(src, dst):
+    """
+    備份設定檔。Linux 上以 os.copy_file_range 由核心直接複製內容再套用 metadata，
+    其他平台或不支援時退回 shutil.copy2。
+    """
+    if hasattr(os, 'copy_file_range'):
+        try:
+            src_fd = os.open(src, os.O_RDONLY)
+            try:
+                dst_fd = os.open(dst, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+                try:
+                    while os.copy_file_range(src_fd, dst_fd, 1 << 30): # 返回 0 表示已到檔案結尾
+                        pass
+                finally:
+                    os.close(dst_fd)
+            finally:
+                os.close(src_fd)
+            shutil.copystat(src, dst)
+            return
+        except OSError as e:
+            logging.debug(f"copy_file_range 備份失敗 ({e})，改用 shutil.copy2。")
+    shutil.copy2(src, dst)
+
+
+def ensure_perms(conf_path, wanted_stat):
+    """
+    僅在權限或擁有者與 wanted_stat 不同時才呼叫 os.chmod / os.chown。
+    返回呼叫前取得的 os.stat 結果 (chmod/chown 不影響其中的 st_mtime_ns 與 st_size)。
+    """
+    st = os.stat(conf_path)
+    wanted_mode = stat.S_IMODE(wanted_stat.st_mode)
+    if stat.S_IMODE(st.st_mode) != wanted_mode:
+        os.chmod(conf_path, wanted_mode)
+    if (st.st_uid, st.st_gid) != (wanted_stat.st_uid, wanted_stat.st_gid):
+        os.chown(conf_path, wanted_stat.st_uid, wanted_stat.st_gid)
+    return st
+
+
+def atomic_rewrite(conf_path, transform, backup_suffix="bak", original_stat=None, ignore_prefix=None, conf_stat=None):
+    """
+    以 transform 串流改寫設定檔：逐行讀取 conf_path，把 transform 產生的每一行寫入同目錄的臨時檔案，
+    備份原檔後以 os.replace 原子地取代。改寫結果與原內容相同時不備份也不取代。
+
+    Args:
+        conf_path (str): proxychains 設定檔路徑。
+        transform (Callable[[Iterable[str]], Iterable[str]]): 接收原始行並產生新行的函數 (通常是 generator)，必須讀完所有輸入行。
+        backup_suffix (str): 備份檔名後綴，備份檔為 f"{conf_path}.{backup_suffix}.{時間戳}"。
+        original_stat (os.stat_result): 要維持的權限與擁有者，未提供時使用改寫前設定檔的。
+        ignore_prefix (str): 比較內容是否變更時略過以此開頭的行 (例如每次都不同的時間戳註解)。
+        conf_stat (os.stat_result): 呼叫端剛取得的設定檔 os.stat 結果，提供時不再重複 stat。
+
+    Returns:
+        os.stat_result: 設定檔已是 (或已更新為) 改寫後的內容時，返回處理後設定檔的 os.stat 結果；失敗返回 None。
+    """
+    if os.geteuid() != 0:
+        logging.error(f"更新 {conf_path} 需要 root 權限。請使用 sudo 執行。")
+        return None
+
+    # 一次 stat 同時確認檔案存在並取得原始權限與擁有者，之後不必再 stat 備份檔
+    if conf_stat is None:
+        try:
+            conf_stat = os.stat(conf_path)
+        except FileNotFoundError:
+            logging.error(f"設定檔 {conf_path} 不存在。")
+            return None
+
+    def digested(lines, digest):
+        for line in lines:
+            if not (ignore_prefix and line.startswith(ignore_prefix)):
+                digest.update(line.encode('utf-8'))
+            yield line
+
+    old_digest, new_digest = hashlib.blake2b(), hashlib.blake2b()
+    temp_path = None
+    # 原檔在 os.replace 之前都不會被修改，因此任何失敗都只需清除臨時檔案，不必從備份還原
+    try:
+        with open(conf_path, 'r', encoding='utf-8') as src, \
+             tempfile.NamedTemporaryFile(mode='w', delete=False, encoding='utf-8', dir=os.path.dirname(conf_path)) as dst:
+            temp_path = dst.name
+            dst.writelines(digested(transform(digested(src, old_digest)), new_digest))
+
+        if old_digest.digest() == new_digest.digest():
+            os.remove(temp_path)
+            logging.info(f"{conf_path} 內容無變更，略過備份與寫入。")
+            return conf_stat
+
+        backup_path = f"{conf_path}.{backup_suffix}.{int(time.time())}"
+        logging.info(f"正在備份 {conf_path} 到 {backup_path}...")
+        try:
+            fast_backup(conf_path, backup_path)
+        except Exception as e:
+            logging.error(f"備份失敗: {e}")
+            os.remove(temp_path)
+            return None
+
+        os.replace(temp_path, conf_path)
+        try:
+            return ensure_perms(conf_path, original_stat or conf_stat)
+        except Exception as e:
+            logging.warning(f"設定檔案權限或擁有者時出錯: {e}")
+            return os.stat(conf_path)
+    except Exception as e:
+        logging.error(f"更新設定檔 {conf_path} 失敗: {e}")
+        # os.replace 成功後臨時檔名即不存在，只有在取代前失敗才需要清除
+        if temp_path:
+            try:
+                os.remove(temp_path)
+            except FileNotFoundError:
+                pass
+        return None